@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 IDM-GridCore 示例：批量 HTTP 请求
-并行抓取多个 URL
+并行抓取多个 URL，状态码分布在消费者本地预聚合后合并到 Redis 哈希
 """
 
 import subprocess
@@ -10,8 +10,13 @@ import os
 import json
 
 
-def create_http_consumer(timeout=30):
-    """生成 HTTP 请求消费者代码"""
+def create_http_consumer(timeout=30, keep_results=True):
+    """
+    生成 HTTP 请求消费者代码
+
+    状态码计数先在本地累加，每隔几秒用 HINCRBY 合并到 "<OUTPUT_QUEUE>:stats"；
+    keep_results=False 时不再逐条写结果，只保留聚合统计
+    """
     return f'''
 import redis
 import os
@@ -26,12 +31,30 @@ INSTANCE_ID = os.getenv("INSTANCE_ID", "0")
 NODE_ID = os.getenv("NODE_ID", "unknown")[:8]
 
 TIMEOUT = {timeout}
+KEEP_RESULTS = {keep_results}
+STATS_KEY = OUTPUT_QUEUE + ":stats"
+FLUSH_SECONDS = 5
 
 r_in = redis.from_url(INPUT_REDIS_URL)
 r_out = redis.from_url(OUTPUT_REDIS_URL)
 
 processed = 0
 errors = 0
+status_counts = {{}}
+last_flush = time.time()
+
+
+def flush_stats():
+    """把本地状态码计数合并到 Redis 哈希"""
+    global status_counts, last_flush
+    if status_counts:
+        pipe = r_out.pipeline()
+        for status, n in status_counts.items():
+            pipe.hincrby(STATS_KEY, status, n)
+        pipe.execute()
+        status_counts = {{}}
+    last_flush = time.time()
+
 
 while True:
     result = r_in.brpop(INPUT_QUEUE, timeout=5)
@@ -48,22 +71,33 @@ while True:
         resp = requests.get(url, timeout=TIMEOUT)
         elapsed = time.time() - start
         
-        # 结果格式: "url|status_code|content_length|elapsed_time"
-        result_str = f"{{url}}|{{resp.status_code}}|{{len(resp.text)}}|{{elapsed:.2f}}"
-        r_out.lpush(OUTPUT_QUEUE, result_str)
+        status = str(resp.status_code)
+        if KEEP_RESULTS:
+            # 结果格式: "url|status_code|content_length|elapsed_time"
+            result_str = f"{{url}}|{{resp.status_code}}|{{len(resp.text)}}|{{elapsed:.2f}}"
+            r_out.lpush(OUTPUT_QUEUE, result_str)
         processed += 1
         
     except requests.exceptions.Timeout:
-        r_out.lpush(OUTPUT_QUEUE, f"{{url}}|TIMEOUT|0|{{TIMEOUT}}")
+        status = "TIMEOUT"
+        if KEEP_RESULTS:
+            r_out.lpush(OUTPUT_QUEUE, f"{{url}}|TIMEOUT|0|{{TIMEOUT}}")
         errors += 1
     except Exception as e:
+        status = "ERROR"
+        # 错误详情始终保留，便于排查
         r_out.lpush(OUTPUT_QUEUE, f"{{url}}|ERROR|0|{{str(e)}}")
         errors += 1
     
+    status_counts[status] = status_counts.get(status, 0) + 1
+    if time.time() - last_flush >= FLUSH_SECONDS:
+        flush_stats()
+    
     if (processed + errors) % 100 == 0:
-        print(f"[{NODE_ID}:{{INSTANCE_ID}}] Processed: {{processed}}, Errors: {{errors}}")
+        print(f"[{{NODE_ID}}:{{INSTANCE_ID}}] Processed: {{processed}}, Errors: {{errors}}")
 
-print(f"[{NODE_ID}:{{INSTANCE_ID}}] Done. Processed: {{processed}}, Errors: {{errors}}")
+flush_stats()
+print(f"[{{NODE_ID}}:{{INSTANCE_ID}}] Done. Processed: {{processed}}, Errors: {{errors}}")
 '''
 
 
@@ -73,6 +107,7 @@ def main():
     COMPUTEHUB_URL = "http://localhost:8080"
     TOKEN = "your-token-here"
     REDIS_URL = "redis://:password@localhost:6379"
+    KEEP_RESULTS = False  # 只统计状态码分布时无需逐条保存结果
     
     print("批量 HTTP 请求示例")
     print("=" * 50)
@@ -99,7 +134,7 @@ def main():
         
         # 生成消费者代码
         print("2. 生成 HTTP 请求代码...")
-        consumer_code = create_http_consumer(timeout=30)
+        consumer_code = create_http_consumer(timeout=30, keep_results=KEEP_RESULTS)
         
         with open(os.path.join(workdir, "consumer.py"), "w") as f:
             f.write(consumer_code)
@@ -156,7 +191,7 @@ CMD ["python", "/app/consumer.py"]
         
         import redis
         r = redis.from_url(REDIS_URL)
-        r.delete("http:input", "http:output")
+        r.delete("http:input", "http:output", "http:output:stats")
         
         # 批量推送
         batch = []
@@ -174,11 +209,15 @@ CMD ["python", "/app/consumer.py"]
         print("任务已提交，正在并行请求...")
         print("=" * 50)
         print(f"\n监控进度:")
-        print(f"  redis-cli -u {REDIS_URL} llen http:output")
-        print(f"\n查看结果:")
-        print(f"  redis-cli -u {REDIS_URL} lrange http:output 0 9")
-        print(f"\n统计状态码分布:")
-        print(f"  redis-cli -u {REDIS_URL} lrange http:output 0 -1 | cut -d'|' -f2 | sort | uniq -c")
+        print(f"  redis-cli -u {REDIS_URL} llen http:input")
+        print(f"\n统计状态码分布（消费者预聚合，每 5 秒合并一次）:")
+        print(f"  redis-cli -u {REDIS_URL} hgetall http:output:stats")
+        if KEEP_RESULTS:
+            print(f"\n查看结果:")
+            print(f"  redis-cli -u {REDIS_URL} lrange http:output 0 9")
+        else:
+            print(f"\n查看错误详情:")
+            print(f"  redis-cli -u {REDIS_URL} lrange http:output 0 9")
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@
 """
 IDM-GridCore 示例：批量图片处理
 将目录中的所有图片生成缩略图
+Pillow 的原生内存会随任务数增长，消费者超过 RSS 上限时原地重启工作进程
 """
 
 import os
@@ -9,11 +10,18 @@ import subprocess
 import tempfile
 
 
-def create_image_consumer(width=300, height=300):
-    """生成图片处理消费者代码"""
+def create_image_consumer(width=300, height=300, max_rss_mb=512, max_tasks=50000):
+    """
+    生成图片处理消费者代码
+
+    每处理完一张图片检查一次 RSS 和任务数，超过 max_rss_mb / max_tasks 时
+    用 os.execv 原地重启进程（容器不退出，不丢失已写回的结果）。
+    第一张图片只记录预热后的 RSS，已超过 max_rss_mb 时不再按 RSS 重启，避免每张图片都重启
+    """
     return f'''
 import redis
 import os
+import sys
 from PIL import Image
 import io
 
@@ -28,11 +36,23 @@ NODE_ID = os.getenv("NODE_ID", "unknown")[:8]
 THUMB_WIDTH = {width}
 THUMB_HEIGHT = {height}
 
+# 内存守护（0 表示不限制）
+MAX_RSS_MB = int(os.getenv("MAX_RSS_MB", "{max_rss_mb}"))
+MAX_TASKS_PER_WORKER = int(os.getenv("MAX_TASKS_PER_WORKER", "{max_tasks}"))
+
+
+def get_rss_mb():
+    """当前进程常驻内存（MB）"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
 r_in = redis.from_url(INPUT_REDIS_URL)
 r_out = redis.from_url(OUTPUT_REDIS_URL)
 
 processed = 0
 errors = 0
+rss_check = bool(MAX_RSS_MB)
 
 while True:
     result = r_in.brpop(INPUT_QUEUE, timeout=5)
@@ -69,9 +89,22 @@ while True:
         errors += 1
     
     if (processed + errors) % 100 == 0:
-        print(f"[{NODE_ID}:{{INSTANCE_ID}}] Processed: {{processed}}, Errors: {{errors}}")
+        print(f"[{{NODE_ID}}:{{INSTANCE_ID}}] Processed: {{processed}}, Errors: {{errors}}")
+    
+    # 当前图片已写回，超限则原地重启工作进程
+    rss = get_rss_mb()
+    if rss_check and processed + errors == 1 and rss >= MAX_RSS_MB:
+        # 导入 Pillow、处理第一张图片后已超限，重启也降不下来
+        print(f"[{{NODE_ID}}:{{INSTANCE_ID}}] RSS {{rss:.0f}} MB after first task already >= "
+              f"MAX_RSS_MB ({{MAX_RSS_MB}}), RSS limit disabled for this worker; raise MAX_RSS_MB")
+        rss_check = False
+    if (rss_check and processed + errors > 1 and rss >= MAX_RSS_MB) or \\
+            (MAX_TASKS_PER_WORKER and processed + errors >= MAX_TASKS_PER_WORKER):
+        print(f"[{{NODE_ID}}:{{INSTANCE_ID}}] Recycling worker: rss={{rss:.0f}}MB, "
+              f"tasks={{processed + errors}}", flush=True)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
 
-print(f"[{NODE_ID}:{{INSTANCE_ID}}] Done. Processed: {{processed}}, Errors: {{errors}}")
+print(f"[{{NODE_ID}}:{{INSTANCE_ID}}] Done. Processed: {{processed}}, Errors: {{errors}}")
 '''
 
 
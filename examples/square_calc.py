@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 IDM-GridCore 示例：计算 1 到 N 的平方
-展示完整的任务提交流程
+展示完整的任务提交流程：推送紧凑的下标区间任务，消费者在本地展开计算
 """
 
 import subprocess
@@ -19,6 +19,7 @@ def run_command(cmd, cwd=None):
 def main():
     # 配置
     N = 10000  # 计算 1 到 10000 的平方
+    CHUNK_SIZE = 500  # 每个区间任务包含的点数
     COMPUTEHUB_URL = "http://localhost:8080"
     TOKEN = "your-token-here"  # 替换为实际的 token
     REDIS_URL = "redis://:password@localhost:6379"
@@ -35,7 +36,7 @@ def main():
         consumer_code = '''
 import redis
 import os
-import math
+import json
 
 INPUT_REDIS_URL = os.getenv("INPUT_REDIS_URL")
 OUTPUT_REDIS_URL = os.getenv("OUTPUT_REDIS_URL", INPUT_REDIS_URL)
@@ -57,17 +58,16 @@ while True:
         continue
     
     _, task_data = result
-    n = int(task_data.decode() if isinstance(task_data, bytes) else task_data)
-    
-    # 计算平方
-    result = n * n
+    # 任务格式: {"type": "range", "start": a, "stop": b}，对应下标 [a, b)
+    chunk = json.loads(task_data)
     
-    # 写回结果: "n:result"
-    r_out.lpush(OUTPUT_QUEUE, f"{n}:{result}")
+    # 在本地展开区间并计算平方，结果一次写回: "n:result"
+    outputs = [f"{n}:{n * n}" for n in range(chunk["start"], chunk["stop"])]
+    if outputs:
+        r_out.lpush(OUTPUT_QUEUE, *outputs)
     
-    processed += 1
-    if processed % 1000 == 0:
-        print(f"[{NODE_ID}:{INSTANCE_ID}] Progress: {processed}")
+    processed += len(outputs)
+    print(f"[{NODE_ID}:{INSTANCE_ID}] Progress: {processed}")
 
 print(f"[{NODE_ID}:{INSTANCE_ID}] Done. Total: {processed}")
 '''
@@ -118,24 +118,20 @@ CMD ["python", "/app/consumer.py"]
             print(f"   ✗ 注册失败: {stderr}")
             return
         
-        # 步骤 5：推送数据
-        print(f"\n6. 推送 {N} 个任务到队列...")
+        # 步骤 5：推送数据（每个任务是一段下标区间，队列长度随区间数而非点数增长）
+        print(f"\n6. 推送 1..{N} 的下标区间到队列（每段 {CHUNK_SIZE} 个点）...")
         push_script = f'''
-import redis
+import redis, json
 r = redis.from_url("{REDIS_URL}")
 r.delete("square:input", "square:output")
 
-# 批量推送
-batch = []
-for i in range(1, {N+1}):
-    batch.append(str(i))
-    if len(batch) >= 1000:
-        r.lpush("square:input", *batch)
-        batch = []
-if batch:
-    r.lpush("square:input", *batch)
+chunks = [
+    json.dumps({{"type": "range", "start": lo, "stop": min(lo + {CHUNK_SIZE}, {N+1})}})
+    for lo in range(1, {N+1}, {CHUNK_SIZE})
+]
+r.lpush("square:input", *chunks)
 
-print(f"已推送 {{r.llen('square:input')}} 个任务")
+print(f"已推送 {{r.llen('square:input')}} 个区间任务")
 '''
         
         with open(os.path.join(workdir, "push_data.py"), "w") as f:
@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 """
 IDM-GridCore 环境检查脚本
-检查部署所需的环境条件
+检查部署所需的环境条件；--bench 模式测量 Redis 与容器性能并给出调优建议
+
+用法:
+  python3 check_env.py
+  python3 check_env.py --bench --redis-url redis://:pass@host:6379 \
+      --task-ms 20 --job-size 1000000 --nodes 4 --output idm_bench.json
 """
 
+import argparse
+import json
+import math
 import subprocess
 import sys
 import os
 import socket
+import time
 
 
 def check_command(cmd, name):
@@ -86,7 +95,226 @@ def get_architecture():
     return mapped
 
 
+def get_resources():
+    """获取 CPU 核数和内存（MB）"""
+    cpus = os.cpu_count() or 1
+    total_mb = available_mb = None
+    try:
+        total_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available_mb = int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    if available_mb is None:
+        available_mb = total_mb
+
+    print(f"CPU 核数: {cpus}")
+    if total_mb:
+        print(f"内存: {total_mb} MB（可用 {available_mb} MB）")
+    return {"cpus": cpus, "memory_total_mb": total_mb, "memory_available_mb": available_mb}
+
+
+def percentile(values, pct):
+    """简单分位数（values 需已排序）"""
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def bench_redis(redis_url, rounds=200, batch=1000):
+    """测量 Redis 往返延迟、管道吞吐和批量吞吐"""
+    try:
+        import redis
+    except ImportError:
+        print("✗ 未安装 redis 模块，跳过 Redis 测试（pip install redis）")
+        return None
+
+    try:
+        r = redis.from_url(redis_url)
+        r.ping()
+    except Exception as e:
+        print(f"✗ Redis 连接失败: {e}")
+        return None
+
+    # 往返延迟
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        r.ping()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    rtt_p50 = percentile(samples, 50)
+    rtt_p99 = percentile(samples, 99)
+    print(f"✓ 往返延迟: p50 {rtt_p50:.2f} ms, p99 {rtt_p99:.2f} ms")
+
+    key = f"idm:bench:{os.getpid()}"
+    values = [str(i) for i in range(batch)]
+    try:
+        # 管道：每条命令一个元素，一次往返发送 batch 条命令
+        start = time.perf_counter()
+        for _ in range(10):
+            pipe = r.pipeline(transaction=False)
+            for v in values:
+                pipe.lpush(key, v)
+            pipe.execute()
+        pipelined = 10 * batch / (time.perf_counter() - start)
+        r.delete(key)
+        print(f"✓ 管道吞吐: {pipelined:,.0f} ops/s")
+
+        # 批量：单条命令携带 batch 个元素（LPUSH 多值 + RPOP count）
+        start = time.perf_counter()
+        for _ in range(10):
+            r.lpush(key, *values)
+        for _ in range(10):
+            r.rpop(key, batch)
+        batched = 20 * batch / (time.perf_counter() - start)
+        print(f"✓ 批量吞吐: {batched:,.0f} items/s")
+    except Exception as e:
+        print(f"✗ Redis 吞吐测试失败: {e}")
+        return {"rtt_p50_ms": rtt_p50, "rtt_p99_ms": rtt_p99}
+    finally:
+        r.delete(key)
+
+    return {
+        "rtt_p50_ms": rtt_p50,
+        "rtt_p99_ms": rtt_p99,
+        "pipelined_ops_per_s": pipelined,
+        "batched_items_per_s": batched,
+    }
+
+
+def bench_container(image, rounds=3):
+    """
+    测量容器启动时间：docker run 一个空 Python 进程到容器退出（取最小值，排除首次拉取镜像）
+
+    不含连接 Redis 和取到首个任务的时间，是冷启动开销的下限
+    """
+    cmd = ["docker", "run", "--rm", image, "python", "-c", "import sys"]
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+            print(f"✗ 容器启动测试失败: {e}")
+            return None
+        if result.returncode != 0:
+            print(f"✗ 容器启动测试失败: {result.stderr.strip()}")
+            return None
+        samples.append(time.perf_counter() - start)
+
+    startup = min(samples)
+    print(f"✓ 容器启动时间: {startup:.2f} s（{image}，不含连接 Redis 与取首个任务）")
+    return {"image": image, "startup_s": startup}
+
+
+def recommend(resources, redis_stats, container_stats, task_ms, job_size, nodes,
+              instance_mem_mb):
+    """根据测量结果给出每节点实例数、批大小和任务规模建议"""
+    advice = {}
+
+    # 每节点实例数：CPU 核数，受可用内存限制
+    instances = resources["cpus"]
+    if resources["memory_available_mb"]:
+        instances = min(instances, resources["memory_available_mb"] // instance_mem_mb)
+    instances = max(1, instances)
+    advice["instances_per_node"] = instances
+
+    # 批大小：每批取任务要两次往返（BRPOP + RPOP count），让其不超过整批计算时间的 5%；
+    # 且全集群取任务的命令速率（任务速率 / 批大小）不超过 Redis 单条命令吞吐的一半
+    batch_size = 1
+    if redis_stats:
+        batch_size = math.ceil(2 * redis_stats["rtt_p50_ms"] / (0.05 * task_ms))
+        pipelined = redis_stats.get("pipelined_ops_per_s")
+        if pipelined:
+            cluster_rate = nodes * instances * 1000 / task_ms
+            batch_size = max(batch_size, math.ceil(cluster_rate / (pipelined / 2)))
+    batch_size = max(1, min(batch_size, 10000))
+    advice["batch_size"] = batch_size
+
+    # 任务规模：集群加速比不足 2 倍时，不值得上集群
+    if job_size:
+        serial_s = job_size * task_ms / 1000
+        cluster_s = serial_s / (nodes * instances)
+        if container_stats:
+            # 容器启动时间只是冷启动开销的下限
+            cluster_s += container_stats["startup_s"]
+        if redis_stats and redis_stats.get("batched_items_per_s"):
+            cluster_s += job_size / redis_stats["batched_items_per_s"]
+        advice["serial_estimate_s"] = serial_s
+        advice["cluster_estimate_s"] = cluster_s
+        advice["too_small"] = cluster_s * 2 > serial_s
+
+    return advice
+
+
+def run_bench(args):
+    """性能测试并输出调优建议"""
+    print("\n【资源】")
+    resources = get_resources()
+
+    print("\n【Redis 性能】")
+    redis_stats = bench_redis(args.redis_url)
+
+    print("\n【容器启动】")
+    container_stats = bench_container(args.image)
+
+    advice = recommend(resources, redis_stats, container_stats, args.task_ms,
+                       args.job_size, args.nodes, args.instance_mem_mb)
+
+    print("\n【调优建议】")
+    print(f"  每节点实例数: {advice['instances_per_node']}")
+    print(f"  批大小（BATCH_SIZE）: {advice['batch_size']}（按单任务 {args.task_ms:g} ms 估算）")
+    if "too_small" in advice:
+        print(f"  预计耗时: 串行 {advice['serial_estimate_s']:.1f} s，"
+              f"集群 {advice['cluster_estimate_s']:.1f} s（{args.nodes} 节点）")
+        if advice["too_small"]:
+            print("  ✗ 任务规模太小，集群加速不足 2 倍，建议本地直接运行")
+        else:
+            print("  ✓ 任务规模适合集群")
+
+    report = {
+        "timestamp": time.time(),
+        "params": {
+            "task_ms": args.task_ms,
+            "job_size": args.job_size,
+            "nodes": args.nodes,
+            "instance_mem_mb": args.instance_mem_mb,
+        },
+        "resources": resources,
+        "redis": redis_stats,
+        "container": container_stats,
+        "advice": advice,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n结果已写入 {args.output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="IDM-GridCore 环境检查")
+    parser.add_argument("--bench", action="store_true", help="测量性能并给出调优建议")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--image", default="python:3.11-slim", help="用于测量容器启动时间的镜像")
+    parser.add_argument("--task-ms", type=float, default=10, help="单个任务的计算耗时（毫秒）")
+    parser.add_argument("--job-size", type=int, default=0, help="任务总数，用于判断是否值得上集群")
+    parser.add_argument("--nodes", type=int, default=1, help="集群节点数")
+    parser.add_argument("--instance-mem-mb", type=int, default=256, help="每个实例的内存估计（MB）")
+    parser.add_argument("--output", default="idm_bench.json", help="JSON 结果文件")
+    args = parser.parse_args()
+    for name in ("task_ms", "nodes", "instance_mem_mb"):
+        if getattr(args, name) <= 0:
+            parser.error(f"--{name.replace('_', '-')} 必须为正数")
+    return args
+
+
 def main():
+    args = parse_args()
+
     print("=" * 50)
     print("IDM-GridCore 环境检查")
     print("=" * 50)
@@ -140,6 +368,12 @@ def main():
         print("\n注意: 未检测到 Rust 环境，将使用预编译二进制")
         print("如需本地编译，请安装 Rust: https://rustup.rs/")
     
+    if args.bench:
+        print("\n" + "=" * 50)
+        print("性能测试")
+        print("=" * 50)
+        run_bench(args)
+    
     return 0 if all_ok else 1
 
 
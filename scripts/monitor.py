@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+IDM-GridCore 任务进度监控
+汇总消费者发布的进度计数，显示平滑吞吐、ETA 和各节点/实例的速度，
+可选在本地暴露 Prometheus 文本格式的 /metrics 端点
+
+数据来源（与输入队列在同一个 Redis）:
+  <queue>:meta       scripts/push_tasks.py 推送时记录的任务总数 tasks / 点数 items
+  <queue>:progress   templates/consumer.py 发布的 items|tasks|errors:<node>:<instance> 计数
+  <queue>:heartbeat  各实例最近一次心跳时间（消费者后台线程定时刷新）
+
+用法:
+  python3 monitor.py --redis-url $REDIS_URL --queue sqrt:input
+  python3 monitor.py --redis-url $REDIS_URL --queue sqrt:input --prometheus-port 9108 --follow
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Rate:
+    """计数器的指数平滑速率（每秒）"""
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.last = None
+        self.value = None
+
+    def update(self, count, now):
+        if self.last is not None and now > self.last[1]:
+            instant = (count - self.last[0]) / (now - self.last[1])
+            if self.value is None:
+                self.value = instant
+            else:
+                self.value = self.alpha * instant + (1 - self.alpha) * self.value
+        self.last = (count, now)
+        return self.value or 0.0
+
+
+def decode_hash(raw):
+    return {k.decode(): v.decode() for k, v in raw.items()}
+
+
+def read_snapshot(r, queue):
+    """一次往返读取作业元数据、各实例计数和队列长度"""
+    pipe = r.pipeline(transaction=False)
+    pipe.hgetall(f"{queue}:meta")
+    pipe.hgetall(f"{queue}:progress")
+    pipe.hgetall(f"{queue}:heartbeat")
+    pipe.llen(queue)
+    meta, progress, heartbeat, pending = pipe.execute()
+
+    workers = {}
+    for field, value in decode_hash(progress).items():
+        name, _, worker = field.partition(":")
+        workers.setdefault(worker, {"items": 0, "tasks": 0, "errors": 0})[name] = int(value)
+    for worker, seen in decode_hash(heartbeat).items():
+        workers.setdefault(worker, {"items": 0, "tasks": 0, "errors": 0})["last_seen"] = float(seen)
+
+    return {
+        "meta": {k: float(v) for k, v in decode_hash(meta).items()},
+        "workers": workers,
+        "pending": pending,
+    }
+
+
+def compute_status(snap, now, job_rates, worker_rates, total_override=0):
+    """由快照计算进度、速率、ETA 以及节点/实例明细"""
+    meta = snap["meta"]
+    workers = snap["workers"]
+    done_tasks = sum(w["tasks"] for w in workers.values())
+    done_items = sum(w["items"] for w in workers.values())
+    errors = sum(w["errors"] for w in workers.values())
+
+    # 作业总量以提交时记录为准；缺失时退化为 已完成 + 待处理
+    total_tasks = total_override or int(meta.get("tasks", 0)) or done_tasks + snap["pending"]
+    total_items = int(meta.get("items", 0))
+
+    task_rate = job_rates["tasks"].update(done_tasks, now)
+    item_rate = job_rates["items"].update(done_items, now)
+
+    # 点数已知时按点数估算 ETA（区间大小不均时更准确）
+    if total_items and item_rate > 0:
+        eta = max(0, total_items - done_items) / item_rate
+    elif task_rate > 0:
+        eta = max(0, total_tasks - done_tasks) / task_rate
+    else:
+        eta = None
+
+    instances = []
+    nodes = {}
+    for worker, counts in sorted(workers.items()):
+        node, _, instance = worker.partition(":")
+        rate = worker_rates.setdefault(worker, Rate()).update(counts["items"], now)
+        age = now - counts["last_seen"] if "last_seen" in counts else None
+        instances.append({
+            "node": node, "instance": instance, "items": counts["items"],
+            "errors": counts["errors"], "rate": rate, "age": age,
+        })
+        entry = nodes.setdefault(node, {"rate": 0.0, "items": 0, "instances": 0})
+        entry["rate"] += rate
+        entry["items"] += counts["items"]
+        entry["instances"] += 1
+
+    return {
+        "total_tasks": total_tasks,
+        "done_tasks": done_tasks,
+        "total_items": total_items,
+        "done_items": done_items,
+        "errors": errors,
+        "pending": snap["pending"],
+        "task_rate": task_rate,
+        "item_rate": item_rate,
+        "eta": eta,
+        "elapsed": now - meta["submitted_at"] if "submitted_at" in meta else None,
+        "nodes": nodes,
+        "instances": instances,
+    }
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+def print_status(queue, status, show_instances, stale_seconds):
+    """打印一屏状态；节点速度低于中位数一半时标记"""
+    if sys.stdout.isatty():
+        print("\033[H\033[J", end="")
+
+    total, done = status["total_tasks"], status["done_tasks"]
+    pct = done / total * 100 if total else 0.0
+    print(f"队列: {queue}")
+    print(f"进度: {done:,}/{total:,} 任务 ({pct:.1f}%)  待处理: {status['pending']:,}  "
+          f"错误: {status['errors']:,}")
+    items = f"{status['done_items']:,}"
+    if status["total_items"]:
+        items += f"/{status['total_items']:,}"
+    print(f"点数: {items}  速度: {status['item_rate']:,.0f} 点/s "
+          f"({status['task_rate']:,.1f} 任务/s)")
+    print(f"已用: {format_duration(status['elapsed'])}  ETA: {format_duration(status['eta'])}")
+
+    nodes = status["nodes"]
+    if nodes:
+        rates = sorted(n["rate"] for n in nodes.values())
+        median = rates[len(rates) // 2]
+        print(f"\n{'节点':<10}{'实例':>6}{'点数':>14}{'点/s':>12}")
+        for node, n in sorted(nodes.items()):
+            flag = "  ⚠ 慢" if len(nodes) > 1 and n["rate"] < 0.5 * median else ""
+            print(f"{node:<10}{n['instances']:>6}{n['items']:>14,}{n['rate']:>12,.0f}{flag}")
+
+    if show_instances and status["instances"]:
+        print(f"\n{'实例':<16}{'点数':>14}{'点/s':>12}{'错误':>8}  最近上报")
+        for inst in status["instances"]:
+            worker = f"{inst['node']}:{inst['instance']}"
+            age = "--" if inst["age"] is None else f"{inst['age']:.0f}s 前"
+            if inst["age"] is not None and inst["age"] > stale_seconds:
+                age += "（失联）"
+            print(f"{worker:<16}{inst['items']:>14,}{inst['rate']:>12,.0f}"
+                  f"{inst['errors']:>8,}  {age}")
+
+
+def label(**kv):
+    """Prometheus 标签集，转义反斜杠、引号和换行"""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in kv.items()) + "}"
+
+
+def render_prometheus(queue, status):
+    """Prometheus 文本格式"""
+    lines = []
+
+    def metric(kind, name, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+
+    def gauge(name, help_text, samples):
+        metric("gauge", name, help_text, samples)
+
+    def counter(name, help_text, samples):
+        # 单调累加的计数，按约定以 _total 结尾
+        metric("counter", name, help_text, samples)
+
+    q = label(queue=queue)
+    gauge("idm_job_tasks_submitted", "Tasks submitted for the job", [(q, status["total_tasks"])])
+    if status["total_items"]:
+        gauge("idm_job_items_submitted", "Items submitted for the job", [(q, status["total_items"])])
+    counter("idm_job_tasks_done_total", "Tasks completed", [(q, status["done_tasks"])])
+    counter("idm_job_items_done_total", "Items (points/lines) completed", [(q, status["done_items"])])
+    counter("idm_job_errors_total", "Failed tasks", [(q, status["errors"])])
+    gauge("idm_job_pending_tasks", "Tasks still in the input queue", [(q, status["pending"])])
+    gauge("idm_job_items_per_second", "Smoothed item throughput", [(q, f"{status['item_rate']:.3f}")])
+    gauge("idm_job_tasks_per_second", "Smoothed task throughput", [(q, f"{status['task_rate']:.3f}")])
+    if status["eta"] is not None:
+        gauge("idm_job_eta_seconds", "Estimated seconds to completion", [(q, f"{status['eta']:.1f}")])
+
+    gauge("idm_node_items_per_second", "Smoothed item throughput per node",
+          [(label(queue=queue, node=node), f"{n['rate']:.3f}")
+           for node, n in sorted(status["nodes"].items())])
+    counter("idm_instance_items_done_total", "Items completed per instance",
+          [(label(queue=queue, node=i["node"], instance=i["instance"]), i["items"])
+           for i in status["instances"]])
+    gauge("idm_instance_items_per_second", "Smoothed item throughput per instance",
+          [(label(queue=queue, node=i["node"], instance=i["instance"]), f"{i['rate']:.3f}")
+           for i in status["instances"]])
+    gauge("idm_instance_last_seen_seconds", "Seconds since the instance's last heartbeat",
+          [(label(queue=queue, node=i["node"], instance=i["instance"]), f"{i['age']:.1f}")
+           for i in status["instances"] if i["age"] is not None])
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics 返回最近一次采样的指标"""
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics_text.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(host, port):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.metrics_text = ""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"✓ Prometheus 端点: http://{host}:{port}/metrics")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IDM-GridCore 任务进度监控")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--queue", required=True, help="输入队列名")
+    parser.add_argument("--interval", type=float, default=2, help="刷新间隔（秒）")
+    parser.add_argument("--total", type=int, default=0, help="覆盖任务总数（未通过 push_tasks.py 推送时使用）")
+    parser.add_argument("--instances", action="store_true", help="显示每个实例的明细")
+    parser.add_argument("--stale-seconds", type=float, default=30, help="超过该时间未上报视为失联")
+    parser.add_argument("--follow", action="store_true", help="作业完成后继续监控")
+    parser.add_argument("--prometheus-port", type=int, default=0, help="暴露 /metrics 的端口（0 为关闭）")
+    parser.add_argument("--prometheus-host", default="127.0.0.1")
+    args = parser.parse_args()
+
+    import redis
+    try:
+        r = redis.from_url(args.redis_url)
+        r.ping()
+    except Exception as e:
+        print(f"✗ Redis 连接失败: {e}")
+        return 1
+
+    server = None
+    if args.prometheus_port:
+        server = start_metrics_server(args.prometheus_host, args.prometheus_port)
+
+    job_rates = {"tasks": Rate(), "items": Rate()}
+    worker_rates = {}
+    try:
+        while True:
+            now = time.time()
+            status = compute_status(read_snapshot(r, args.queue), now, job_rates,
+                                    worker_rates, args.total)
+            if server is not None:
+                server.metrics_text = render_prometheus(args.queue, status)
+            print_status(args.queue, status, args.instances, args.stale_seconds)
+
+            finished = (status["total_tasks"] > 0 and status["pending"] == 0
+                        and status["done_tasks"] >= status["total_tasks"])
+            if finished and not args.follow:
+                print("\n✓ 完成!")
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
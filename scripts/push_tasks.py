@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+IDM-GridCore 批量任务推送脚本
+推送紧凑的任务描述符（下标区间 / 参数网格 / 共享文件字节区间），由消费者惰性展开
+
+用法:
+  # 1..N 的下标区间，每 10000 个点一个任务
+  python3 push_tasks.py --redis-url $REDIS_URL --queue sqrt:input --chunk-size 10000 \\
+      range --start 1 --stop 10000001
+
+  # 笛卡尔参数网格，每个点附带独立随机种子
+  python3 push_tasks.py --redis-url $REDIS_URL --queue mc:input --chunk-size 5000 \\
+      grid --seed 42 --axes '{"x": {"linspace": [0, 1, 1000]}, "trial": {"range": [0, 100]}}'
+
+  # 共享文件（CSV/JSONL）：按行对齐的字节区间，文件本身不经过 Redis
+  python3 push_tasks.py --redis-url $REDIS_URL --queue clean:input \\
+      file --path /data/big.csv --chunk-bytes 67108864 --skip-header
+
+推送时在 <queue>:meta 记录任务总数（tasks）、点数（items，文件源未知）和提交时间，
+scripts/monitor.py 据此计算进度与 ETA
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+
+
+def axis_size(spec):
+    """参数轴的取值个数（与 templates/consumer.py 的 axis_values 对应）"""
+    if isinstance(spec, list):
+        return len(spec)
+    if "range" in spec:
+        return len(range(*spec["range"]))
+    if "linspace" in spec:
+        return int(spec["linspace"][2])
+    raise ValueError(f"Unknown axis spec: {spec}")
+
+
+# 消费者为每个网格点附加的字段，不能用作轴名
+RESERVED_AXES = ("index", "seed")
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_axes(axes):
+    """检查参数网格的轴定义，不合法时抛出 ValueError"""
+    if not isinstance(axes, dict) or not axes:
+        raise ValueError("axes 必须是非空的 JSON 对象")
+    for name, spec in axes.items():
+        if name in RESERVED_AXES:
+            raise ValueError(f"轴名 {name!r} 与消费者附加的字段冲突"
+                             f"（保留: {', '.join(RESERVED_AXES)}）")
+        if isinstance(spec, list):
+            if not spec:
+                raise ValueError(f"轴 {name!r} 的取值列表为空")
+        elif isinstance(spec, dict) and "range" in spec:
+            args = spec["range"]
+            if not (isinstance(args, list) and 1 <= len(args) <= 3 and all(is_int(a) for a in args)):
+                raise ValueError(f"轴 {name!r}: range 需要 1~3 个整数 [start, stop, step]，得到 {args}")
+            if len(args) == 3 and args[2] == 0:
+                raise ValueError(f"轴 {name!r}: range 的 step 不能为 0")
+            if not range(*args):
+                raise ValueError(f"轴 {name!r}: range {args} 为空")
+        elif isinstance(spec, dict) and "linspace" in spec:
+            args = spec["linspace"]
+            if not (isinstance(args, list) and len(args) == 3
+                    and is_number(args[0]) and is_number(args[1]) and is_int(args[2])):
+                raise ValueError(f"轴 {name!r}: linspace 需要 [a, b, n]，n 为整数，得到 {args}")
+            if args[2] <= 0:
+                raise ValueError(f"轴 {name!r}: linspace 的点数 n 必须为正数，得到 {args[2]}")
+        else:
+            raise ValueError(f"轴 {name!r}: 未知写法 {spec}")
+
+
+def grid_size(axes):
+    """参数网格的总点数（轴定义不合法时抛出 ValueError）"""
+    validate_axes(axes)
+    return math.prod(axis_size(spec) for spec in axes.values())
+
+
+def make_range_tasks(start, stop, chunk_size):
+    """把下标区间 [start, stop) 切成若干个任务描述符"""
+    for lo in range(start, stop, chunk_size):
+        yield json.dumps({
+            "type": "range",
+            "start": lo,
+            "stop": min(lo + chunk_size, stop),
+        })
+
+
+def make_grid_tasks(axes, chunk_size, seed=0):
+    """把参数网格按扁平下标切成若干个任务描述符"""
+    total = grid_size(axes)
+    for lo in range(0, total, chunk_size):
+        yield json.dumps({
+            "type": "grid",
+            "axes": axes,
+            "start": lo,
+            "stop": min(lo + chunk_size, total),
+            "seed": seed,
+        })
+
+
+def make_file_tasks(local_path, chunk_bytes, path=None, skip_header=False, encoding="utf-8"):
+    """
+    把文件切成按行对齐的字节区间任务描述符
+
+    只在每个切分点附近 seek + readline，不读取整个文件。
+    path 是消费者容器内看到的路径（默认与 local_path 相同）；
+    非 UTF-8 文件（如 GBK 编码的 CSV）的编码随描述符下发；
+    按换行切分，不支持字段内含换行的 CSV
+    """
+    path = path or local_path
+    size = os.path.getsize(local_path)
+    with open(local_path, "rb") as f:
+        header = None
+        pos = 0
+        if skip_header:
+            header = f.readline().rstrip(b"\r\n").decode(encoding)
+            pos = f.tell()
+        while pos < size:
+            f.seek(min(pos + chunk_bytes, size))
+            if f.tell() < size:
+                # 切分点落在行中间时，延伸到该行结尾
+                f.seek(f.tell() - 1)
+                f.readline()
+            end = f.tell()
+            task = {"type": "file", "path": path, "start": pos, "stop": end}
+            if header is not None:
+                task["header"] = header
+            if encoding != "utf-8":
+                task["encoding"] = encoding
+            yield json.dumps(task)
+            pos = end
+
+
+def push(redis_url, queue, tasks, clear=False, items=None):
+    """批量推送任务描述符并记录任务元数据，返回推送数量"""
+    import time
+    import redis
+    r = redis.from_url(redis_url)
+    meta_key = f"{queue}:meta"
+    if clear:
+        r.delete(queue, meta_key, f"{queue}:progress", f"{queue}:heartbeat")
+    r.hsetnx(meta_key, "submitted_at", f"{time.time():.3f}")
+
+    pushed = 0
+    batch = []
+    for task in tasks:
+        batch.append(task)
+        if len(batch) >= 1000:
+            r.lpush(queue, *batch)
+            pushed += len(batch)
+            batch = []
+    if batch:
+        r.lpush(queue, *batch)
+        pushed += len(batch)
+
+    # 追加推送时累加，监控端以此为作业总量
+    r.hincrby(meta_key, "tasks", pushed)
+    if items is not None:
+        r.hincrby(meta_key, "items", items)
+    return pushed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推送批量任务描述符到 Redis 队列")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--queue", required=True, help="输入队列名")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="每个任务包含的点数")
+    parser.add_argument("--clear", action="store_true", help="推送前清空输入队列及其进度记录")
+    sub = parser.add_subparsers(dest="kind", required=True)
+
+    p_range = sub.add_parser("range", help="扁平下标区间 [start, stop)")
+    p_range.add_argument("--start", type=int, default=0)
+    p_range.add_argument("--stop", type=int, required=True)
+
+    p_grid = sub.add_parser("grid", help="笛卡尔参数网格")
+    p_grid.add_argument("--axes", required=True,
+                        help='JSON，如 {"x": [1, 2], "y": {"range": [0, 10]}, "z": {"linspace": [0, 1, 50]}}')
+    p_grid.add_argument("--seed", type=int, default=0, help="基础种子，每个点的种子为 seed + 下标")
+
+    p_file = sub.add_parser("file", help="共享文件（CSV/JSONL）的按行对齐字节区间")
+    p_file.add_argument("--path", required=True, help="本地文件路径")
+    p_file.add_argument("--container-path", help="消费者容器内的文件路径（默认同 --path）")
+    p_file.add_argument("--chunk-bytes", type=int, default=64 * 1024 * 1024, help="每个任务的字节数")
+    p_file.add_argument("--skip-header", action="store_true", help="跳过首行（CSV 表头），随任务下发")
+    p_file.add_argument("--encoding", default="utf-8", help="文件编码，如 gbk")
+
+    args = parser.parse_args()
+
+    if args.chunk_size <= 0:
+        print("✗ --chunk-size 必须为正数")
+        return 1
+
+    items = None
+    if args.kind == "range":
+        items = max(0, args.stop - args.start)
+        total = f"{items:,} 个点"
+        tasks = make_range_tasks(args.start, args.stop, args.chunk_size)
+    elif args.kind == "grid":
+        try:
+            axes = json.loads(args.axes)
+            items = grid_size(axes)
+        except ValueError as e:
+            print(f"✗ --axes 不合法: {e}")
+            return 1
+        total = f"{items:,} 个点"
+        tasks = make_grid_tasks(axes, args.chunk_size, args.seed)
+    else:
+        if args.chunk_bytes <= 0:
+            print("✗ --chunk-bytes 必须为正数")
+            return 1
+        total = f"{os.path.getsize(args.path):,} 字节"
+        tasks = make_file_tasks(args.path, args.chunk_bytes, args.container_path,
+                                args.skip_header, args.encoding)
+
+    pushed = push(args.redis_url, args.queue, tasks, clear=args.clear, items=items)
+    print(f"✓ 已推送 {pushed} 个任务（共 {total}）到 {args.queue}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
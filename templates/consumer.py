@@ -2,13 +2,33 @@
 """
 IDM-GridCore 消费者模板
 从 Redis 队列取任务，处理后写回结果队列
+支持普通字符串任务，以及由 scripts/push_tasks.py 推送的批量描述符（下标区间 / 参数网格 / 共享文件字节区间）
+设置 REDUCE_KEY 后进入聚合模式：本地预聚合，定期合并到 Redis 哈希，不再逐条写结果
+设置 MAX_RSS_MB / MAX_TASKS_PER_WORKER 后，超限时处理完当前任务即原地重启工作进程
+进度计数定期发布到 <INPUT_QUEUE>:progress，由 scripts/monitor.py 汇总吞吐与 ETA
+设置 INPUT_QUEUES 后进入多作业常驻模式：按权重或严格优先级监听多个队列，分发给注册的处理函数
+设置 PREFETCH_BATCHES 后由后台线程预取下一批任务，取任务的往返与计算重叠
 """
 
 import redis
 import os
 import sys
+import csv
 import json
+import math
+import mmap
+import random
+import signal
+import threading
 import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import numpy
+except ImportError:  # 可选：只有定义了 process_range / process_grid 等向量化钩子时才用到
+    numpy = None
 
 # Redis 连接配置（GridNode 自动注入的环境变量）
 INPUT_REDIS_URL = os.getenv("INPUT_REDIS_URL", "redis://localhost:6379")
@@ -21,13 +41,268 @@ INSTANCE_ID = os.getenv("INSTANCE_ID", "0")
 NODE_ID = os.getenv("NODE_ID", "unknown")[:8]
 TASK_NAME = os.getenv("TASK_NAME", "unknown")
 
+# 多作业常驻模式（可选）：INPUT_QUEUES="urgent:input=10,bulk:input=1"
+INPUT_QUEUES = os.getenv("INPUT_QUEUES", "")
+QUEUE_POLICY = os.getenv("QUEUE_POLICY", "weighted")  # weighted | priority（按列出顺序）
+POOL_IDLE_EXIT = float(os.getenv("POOL_IDLE_EXIT", "0"))  # 空闲多少秒后退出，0 表示常驻
+
+# 批量取任务与预取（可选）：BRPOP 1 个后再 RPOP 至多 BATCH_SIZE - 1 个（需 Redis 6.2+）
+BATCH_SIZE = max(1, int(os.getenv("BATCH_SIZE", "1")))
+PREFETCH_BATCHES = max(0, int(os.getenv("PREFETCH_BATCHES", "0")))  # 预取的批次数，0 表示不预取
+PREFETCH_MAX_ITEMS = int(os.getenv("PREFETCH_MAX_ITEMS", str(BATCH_SIZE * PREFETCH_BATCHES)))
+if PREFETCH_BATCHES and PREFETCH_MAX_ITEMS < BATCH_SIZE:
+    # 上限不足一批时预取线程永远等不到空位，至少容纳一批
+    PREFETCH_MAX_ITEMS = BATCH_SIZE
+
+# 共享文件区间每处理多少行结果写回一次，单个区间在内存中最多保留这么多条结果
+FILE_FLUSH_LINES = max(1, int(os.getenv("FILE_FLUSH_LINES", "1000")))
+
+# 进度发布（供 scripts/monitor.py 使用），键为 <输入队列>:progress / <输入队列>:heartbeat
+PROGRESS_SECONDS = float(os.getenv("PROGRESS_SECONDS", "2"))
+
+# 聚合模式（可选）：只需要汇总结果的任务（计数、求和、直方图、最值）
+REDUCE_KEY = os.getenv("REDUCE_KEY", "")
+REDUCE_FLUSH_SECONDS = float(os.getenv("REDUCE_FLUSH_SECONDS", "5"))
+
+# 内存守护（可选）：0 表示不限制
+MAX_RSS_MB = float(os.getenv("MAX_RSS_MB", "0"))
+MAX_TASKS_PER_WORKER = int(os.getenv("MAX_TASKS_PER_WORKER", "0"))
+TRACEMALLOC_TOP = int(os.getenv("TRACEMALLOC_TOP", "0"))
+WORKER_GENERATION = int(os.getenv("WORKER_GENERATION", "0"))
+
+# 合并 min/max：仅当新值更优（或字段不存在）时覆盖
+MERGE_MINMAX_LUA = """
+local key = KEYS[1]
+for i = 1, #ARGV, 2 do
+    local field = ARGV[i]
+    local value = tonumber(ARGV[i + 1])
+    local current = tonumber(redis.call('HGET', key, field))
+    if current == nil
+        or (string.sub(field, 1, 4) == 'min:' and value < current)
+        or (string.sub(field, 1, 4) == 'max:' and value > current) then
+        redis.call('HSET', key, field, ARGV[i + 1])
+    end
+end
+return 1
+"""
+
+
+def parse_queues(spec: str) -> list:
+    """解析 "queue=weight,queue=weight"，权重缺省为 1，必须为正数"""
+    queues = []
+    for entry in spec.split(","):
+        name, _, weight = entry.strip().partition("=")
+        if name:
+            value = float(weight) if weight else 1.0
+            if not value > 0:
+                raise ValueError(f"INPUT_QUEUES: weight for {name.strip()} must be positive, "
+                                 f"got {weight}")
+            queues.append((name.strip(), value))
+    return queues
+
+
+POOL_MODE = bool(INPUT_QUEUES)
+QUEUES = parse_queues(INPUT_QUEUES) if POOL_MODE else [(INPUT_QUEUE, 1.0)]
+
+# 输入队列 -> (处理函数, 输出队列)，由 @handler 注册
+HANDLERS = {}
+
+
+def handler(queue: str, output_queue: str = None):
+    """
+    注册某个输入队列的处理函数（多作业常驻模式）
+    
+    处理函数签名与 process_task 相同；输出队列缺省为把队列名结尾的 :input 换成 :output
+    """
+    def register(func):
+        HANDLERS[queue] = (func, output_queue)
+        return func
+    return register
+
+
+def resolve_handler(queue: str):
+    """返回 (处理函数, 输出队列)；未注册的队列使用 process_task"""
+    func, output_queue = HANDLERS.get(queue, (process_task, None))
+    if output_queue is None:
+        if not POOL_MODE:
+            output_queue = OUTPUT_QUEUE
+        elif queue.endswith(":input"):
+            output_queue = queue[:-len(":input")] + ":output"
+        else:
+            output_queue = f"{queue}:output"
+    return func, output_queue
+
+
+def select_queues() -> list:
+    """
+    本次 BRPOP 的队列顺序（BRPOP 从第一个非空队列取任务）
+    
+    priority: 按列出顺序，严格优先；
+    weighted: 按权重随机排序，各队列都有任务时被选中的概率与权重成正比
+    """
+    if len(QUEUES) == 1 or QUEUE_POLICY == "priority":
+        return [name for name, _ in QUEUES]
+    keyed = [(random.random() ** (1.0 / weight), name) for name, weight in QUEUES]
+    return [name for _, name in sorted(keyed, reverse=True)]
+
+
+# Redis < 6.2 不支持 RPOP count，首次报错后退化为每次只取 1 个
+rpop_count_supported = True
+
+
+def fetch_batch(r, size: int, timeout: int) -> list:
+    """
+    取一批任务，返回 [(队列名, 任务字符串), ...]；超时返回空列表
+    
+    先 BRPOP 阻塞取 1 个，再从同一队列 RPOP 至多 size - 1 个，共两次往返；
+    RPOP 失败时仍返回已 BRPOP 取出的那个任务，不会丢失
+    """
+    global rpop_count_supported
+    result = r.brpop(select_queues(), timeout=timeout)
+    if result is None:
+        return []
+    queue, task_data = result
+    queue = queue.decode() if isinstance(queue, bytes) else queue
+    items = [task_data]
+    if size > 1 and rpop_count_supported:
+        try:
+            items.extend(r.rpop(queue, size - 1) or [])
+        except redis.exceptions.ResponseError as e:
+            rpop_count_supported = False
+            print(f"[{NODE_ID}:{INSTANCE_ID}] RPOP count unsupported ({e}), "
+                  f"fetching one task at a time")
+        except Exception as e:
+            print(f"[{NODE_ID}:{INSTANCE_ID}] Batch RPOP failed, continuing with 1 task: {e}")
+    return [(queue, t.decode() if isinstance(t, bytes) else t) for t in items]
+
+
+def requeue(r, batch: list):
+    """把未处理的任务放回各自队列的尾部（即下一个被 RPOP 取走的位置），保持原有顺序"""
+    by_queue = {}
+    for queue, task_str in batch:
+        by_queue.setdefault(queue, []).append(task_str)
+    for queue, tasks in by_queue.items():
+        r.rpush(queue, *reversed(tasks))
+
+
+def return_unfinished(r, batch: list):
+    """中断或异常时把当前批次中尚未完成的任务放回队列；失败时报告丢失数量"""
+    if not batch:
+        return
+    try:
+        requeue(r, batch)
+        print(f"[{NODE_ID}:{INSTANCE_ID}] Returned {len(batch)} unfinished tasks to queue")
+    except Exception as e:
+        print(f"[{NODE_ID}:{INSTANCE_ID}] Failed to return {len(batch)} tasks to queue: {e}")
+
+
+def handle_sigterm(signum, frame):
+    """docker stop 发送 SIGTERM：按 Ctrl-C 处理，走同一条退出路径（放回任务、合并结果）"""
+    raise KeyboardInterrupt
+
+
+@contextmanager
+def signals_deferred():
+    """
+    取任务期间推迟 SIGTERM / SIGINT，代码块结束后再触发
+    
+    BRPOP / RPOP 已在服务端出队、结果还没赋给当前批次时被中断，这些任务就无从放回；
+    推迟后中断最多延后一次取任务的超时（5 秒）
+    """
+    if not hasattr(signal, "pthread_sigmask"):
+        yield
+        return
+    old = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, old)
+
+
+class Prefetcher:
+    """
+    后台线程预取任务批次，让下一批的 Redis 往返（含阻塞等待）与当前批的计算重叠
+    
+    最多持有 PREFETCH_BATCHES 个批次、PREFETCH_MAX_ITEMS 个任务，避免饿死其他实例；
+    stop() 时把尚未处理的任务放回队列；放回失败时任务仍留在本地，可再次 start() 继续处理
+    """
+    
+    def __init__(self, r):
+        self.r = r
+        self.ready = deque()
+        self.held = 0
+        self.stopping = False
+        self.cond = threading.Condition()
+        self.thread = None
+    
+    def start(self):
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.stopping and (len(self.ready) >= PREFETCH_BATCHES
+                                             or self.held >= PREFETCH_MAX_ITEMS):
+                    self.cond.wait()
+                if self.stopping:
+                    return
+                room = min(BATCH_SIZE, PREFETCH_MAX_ITEMS - self.held)
+            try:
+                # 短超时，便于 stop() 及时结束线程
+                batch = fetch_batch(self.r, room, timeout=1)
+            except Exception as e:
+                print(f"[{NODE_ID}:{INSTANCE_ID}] Prefetch error: {e}")
+                time.sleep(1)
+                continue
+            if batch:
+                with self.cond:
+                    self.ready.append(batch)
+                    self.held += len(batch)
+                    self.cond.notify_all()
+    
+    def get(self, timeout: float) -> list:
+        """取下一个已预取的批次；超时返回空列表"""
+        deadline = time.time() + timeout
+        with self.cond:
+            while not self.ready:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self.cond.wait(remaining)
+            batch = self.ready.popleft()
+            self.held -= len(batch)
+            self.cond.notify_all()
+            return batch
+    
+    def stop(self, unfinished: list = ()):
+        """
+        停止预取线程，并把已取未处理的任务放回队列；放回失败时抛出异常，本地任务保留
+        
+        unfinished 为当前批次中未完成的任务，比预取的任务先取出，一并放回以保持原有顺序
+        """
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.thread.join()
+        leftovers = list(unfinished) + [item for batch in self.ready for item in batch]
+        if leftovers:
+            requeue(self.r, leftovers)
+            print(f"[{NODE_ID}:{INSTANCE_ID}] Returned {len(leftovers)} unfinished and "
+                  f"prefetched tasks to queue")
+        self.ready.clear()
+        self.held = 0
+
 
-def process_task(task_data: str) -> str:
+def process_task(task_data: str, header: str = None) -> str:
     """
     处理单个任务
     
     Args:
         task_data: 从队列取出的任务数据（字符串或 JSON）
+        header: 共享文件区间带表头（--skip-header）时为表头行，可用 csv_record 转成 dict；
+                其他情况为 None
     
     Returns:
         处理结果（字符串）
@@ -42,10 +317,581 @@ def process_task(task_data: str) -> str:
         return f"ERROR:Invalid input: {task_data}"
 
 
+# 可选：下标区间的向量化实现（需要 numpy），x 为 int64 数组 [start, stop)
+# 定义后（替换下面的 None）range 描述符整段调用它，不再逐点调用 process_task，
+# 结果须与 process_task 一致，例如
+#
+# def process_range(x) -> list:
+#     y = x.astype(float)
+#     return [f"{n}:{r}" for n, r in zip(y.tolist(), (y * y).tolist())]
+process_range = None
+
+# 可选：参数网格的向量化实现（需要 numpy），points 为 {轴名: 取值数组, "index", "seed"}，
+# 各数组按下标 [start, stop) 对齐；定义后（替换下面的 None）grid 描述符整段调用它，
+# 不再逐点 JSON 编码后调用 process_task，例如
+#
+# def process_grid(points: dict) -> list:
+#     y = points["sigma"] * numpy.sqrt(points["trial"] + 1)
+#     return [f"{i}:{v}" for i, v in zip(points["index"].tolist(), y.tolist())]
+process_grid = None
+
+
+# 多作业常驻模式：为其他输入队列注册处理函数，例如
+#
+# @handler("urgent:input")
+# def process_urgent(task_data: str) -> str:
+#     return task_data.upper()
+#
+# 队列推送的是带表头的共享文件区间时，处理函数需接受 header 参数
+
+
+def csv_record(line: str, header: str) -> dict:
+    """按表头把一行 CSV 解析为 {列名: 值}（与 csv.DictReader 的单行结果一致）"""
+    names = next(csv.reader([header]))
+    values = next(csv.reader([line]))
+    return dict(zip(names, values))
+
+
+class Linspace:
+    """linspace 轴的惰性取值：按下标计算 a + k * step，不生成整条轴"""
+    
+    def __init__(self, a: float, b: float, n: int):
+        self.a = a
+        self.n = int(n)
+        self.step = (b - a) / (self.n - 1) if self.n > 1 else 0.0
+    
+    def __len__(self) -> int:
+        return self.n
+    
+    def __getitem__(self, k: int) -> float:
+        return self.a + k * self.step
+
+
+def axis_values(spec):
+    """
+    参数轴的取值序列（支持 len() 和下标访问，不展开整条轴）
+    
+    支持三种写法：显式列表 [1, 2, 3]、{"range": [start, stop, step]}、
+    {"linspace": [a, b, n]}；range 与 linspace 按下标直接计算取值，
+    每个区间的开销只与区间点数有关，与轴长度无关
+    """
+    if isinstance(spec, list):
+        return spec
+    if "range" in spec:
+        return range(*spec["range"])
+    if "linspace" in spec:
+        return Linspace(*spec["linspace"])
+    raise ValueError(f"Unknown axis spec: {spec}")
+
+
+def iter_grid(axes: dict, start: int, stop: int, seed: int = 0):
+    """
+    按扁平下标 [start, stop) 惰性展开笛卡尔参数网格
+    
+    每个点是一个 dict，包含各参数轴的取值、下标 index 和独立种子 seed + index
+    """
+    names = list(axes)
+    values = [axis_values(axes[name]) for name in names]
+    for index in range(start, stop):
+        picks = []
+        rem = index
+        for vals in reversed(values):
+            rem, k = divmod(rem, len(vals))
+            picks.append(vals[k])
+        point = dict(zip(names, reversed(picks)))
+        point["index"] = index
+        point["seed"] = seed + index
+        yield point
+
+
+def iter_file_lines(path: str, start: int, stop: int):
+    """
+    mmap 共享文件，逐行读取字节区间 [start, stop)，产出 (行首偏移, 原始字节)
+    
+    区间由生产者对齐到行首，文件内容不经过 Redis；空行跳过
+    """
+    if stop <= start:
+        return
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = start
+            while pos < stop:
+                end = mm.find(b"\n", pos, stop)
+                if end == -1:
+                    end = stop
+                line = mm[pos:end].rstrip(b"\r")
+                if line:
+                    yield pos, line
+                pos = end + 1
+
+
+def iter_chunk(chunk: dict):
+    """把批量任务描述符惰性展开为逐个任务字符串（与 process_task 的输入格式一致）"""
+    if chunk["type"] == "range":
+        return (str(i) for i in range(chunk["start"], chunk["stop"]))
+    if chunk["type"] == "grid":
+        points = iter_grid(chunk["axes"], chunk["start"], chunk["stop"], chunk.get("seed", 0))
+        return (json.dumps(p) for p in points)
+    raise ValueError(f"Unknown chunk type: {chunk['type']}")
+
+
+def parse_chunk(task_str: str):
+    """识别批量任务描述符（由 scripts/push_tasks.py 生成），普通任务返回 None"""
+    if not task_str.startswith("{"):
+        return None
+    try:
+        chunk = json.loads(task_str)
+    except ValueError:
+        return None
+    if isinstance(chunk, dict) and chunk.get("type") in ("range", "grid", "file"):
+        return chunk
+    return None
+
+
+def range_array(chunk: dict):
+    """下标区间 [start, stop) 的 int64 数组（整数下标超过 2**53 时 float 会丢精度）"""
+    return numpy.arange(chunk["start"], chunk["stop"], dtype=numpy.int64)
+
+
+def grid_arrays(chunk: dict) -> dict:
+    """
+    参数网格区间的逐轴取值数组，与 iter_grid 的点一一对应
+    
+    Returns:
+        {轴名: 取值数组, "index": 扁平下标, "seed": seed + index}
+    """
+    index = range_array(chunk)
+    names = list(chunk["axes"])
+    columns = {}
+    rem = index
+    for name in reversed(names):
+        vals = axis_values(chunk["axes"][name])
+        rem, k = numpy.divmod(rem, len(vals))
+        if isinstance(vals, range):
+            columns[name] = vals.start + k * vals.step
+        elif isinstance(vals, Linspace):
+            columns[name] = vals.a + k * vals.step
+        else:
+            columns[name] = numpy.asarray(vals)[k]
+    points = {name: columns[name] for name in names}
+    points["index"] = index
+    points["seed"] = chunk.get("seed", 0) + index
+    return points
+
+
+def vectorised(chunk: dict, range_hook, grid_hook):
+    """返回适用于该描述符的向量化钩子及其参数 (hook, arg)，没有时返回 None"""
+    if numpy is None:
+        return None
+    if chunk["type"] == "range" and range_hook is not None:
+        return range_hook, range_array(chunk)
+    if chunk["type"] == "grid" and grid_hook is not None:
+        return grid_hook, grid_arrays(chunk)
+    return None
+
+
+def process_chunk(chunk: dict) -> list:
+    """
+    处理一个批量任务描述符，结果列表一次性写回输出队列
+    
+    定义了 process_range / process_grid 且安装了 numpy 时，下标区间 / 参数网格整段调用对应钩子；
+    其他情况逐点调用 process_task
+    
+    共享文件区间（type 为 file）不经过这里，由 run_file_chunk 逐行处理
+    
+    Args:
+        chunk: {"type": "range", "start", "stop"} 或
+               {"type": "grid", "axes", "start", "stop", "seed"}
+    
+    Returns:
+        处理结果列表（字符串）
+    """
+    hook = vectorised(chunk, process_range, process_grid)
+    if hook is not None:
+        func, arg = hook
+        return func(arg)
+    return [process_task(item) for item in iter_chunk(chunk)]
+
+
+def run_file_chunk(chunk: dict, handle, emit) -> tuple:
+    """
+    逐行处理共享文件区间，单行失败（含解码失败）只影响该行
+    
+    区间按换行切分，CSV 字段内含换行（引号内多行）时会被拆成多行，不支持。
+    结果每 FILE_FLUSH_LINES 条交给 emit 写回一次，内存占用和单条 LPUSH 的参数个数
+    与区间大小无关；emit 失败时异常向上抛出，此前已写回的结果保留
+    
+    Args:
+        chunk: {"type": "file", "path", "start", "stop", "header", "encoding"}
+        handle: 处理一行的函数，返回结果字符串，或 None 表示不写结果；
+                描述符带表头时以 handle(line, header) 调用
+        emit: 写回一批结果的函数（结果列表非空）
+    
+    Returns:
+        (成功行数, 失败行数)；失败行的结果记为 "ERROR:<path>:<偏移>:<原因>"
+    """
+    encoding = chunk.get("encoding", "utf-8")
+    extra = () if chunk.get("header") is None else (chunk["header"],)
+    outputs = []
+    ok = failed = 0
+    for offset, raw in iter_file_lines(chunk["path"], chunk["start"], chunk["stop"]):
+        try:
+            result = handle(raw.decode(encoding), *extra)
+            if result is not None:
+                outputs.append(result)
+            ok += 1
+        except Exception as e:
+            outputs.append(f"ERROR:{chunk['path']}:{offset}:{e}")
+            failed += 1
+        if len(outputs) >= FILE_FLUSH_LINES:
+            emit(outputs)
+            outputs = []
+    if outputs:
+        emit(outputs)
+    return ok, failed
+
+
+def run_handler(func, task_str: str) -> list:
+    """用处理函数处理一个任务（普通任务或批量描述符），返回结果列表"""
+    chunk = parse_chunk(task_str)
+    if chunk is None:
+        return [func(task_str)]
+    if func is process_task:
+        return process_chunk(chunk)
+    return [func(item) for item in iter_chunk(chunk)]
+
+
+class Aggregator:
+    """
+    消费者本地的部分聚合结果
+    
+    定期通过 flush() 合并到 Redis 哈希，字段命名：
+        count:<name>            计数（HINCRBY）
+        sum:<name>              求和（HINCRBYFLOAT）
+        hist:<name>:<bucket>    直方图桶计数（HINCRBY）
+        min:<name> / max:<name> 最值（Lua 合并）
+    
+    sum/min/max 只接受有限值，inf / nan 抛出 ValueError（该任务记为失败，不留下部分结果）
+    """
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        self.counts = {}
+        self.sums = {}
+        self.mins = {}
+        self.maxs = {}
+    
+    def count(self, name: str, n: int = 1):
+        field = f"count:{name}"
+        self.counts[field] = self.counts.get(field, 0) + n
+    
+    @staticmethod
+    def check(field: str, value: float):
+        if not math.isfinite(value):
+            raise ValueError(f"Non-finite value for {field}: {value}")
+    
+    def add(self, name: str, value: float):
+        field = f"sum:{name}"
+        self.check(field, value)
+        self.sums[field] = self.sums.get(field, 0.0) + value
+    
+    def hist(self, name: str, bucket, n: int = 1):
+        field = f"hist:{name}:{bucket}"
+        self.counts[field] = self.counts.get(field, 0) + n
+    
+    def min(self, name: str, value: float):
+        field = f"min:{name}"
+        self.check(field, value)
+        if field not in self.mins or value < self.mins[field]:
+            self.mins[field] = value
+    
+    def max(self, name: str, value: float):
+        field = f"max:{name}"
+        self.check(field, value)
+        if field not in self.maxs or value > self.maxs[field]:
+            self.maxs[field] = value
+    
+    def empty(self) -> bool:
+        return not (self.counts or self.sums or self.mins or self.maxs)
+    
+    def merge(self, other: "Aggregator"):
+        """并入另一个聚合器的部分结果"""
+        for field, n in other.counts.items():
+            self.counts[field] = self.counts.get(field, 0) + n
+        for field, value in other.sums.items():
+            self.sums[field] = self.sums.get(field, 0.0) + value
+        for field, value in other.mins.items():
+            if field not in self.mins or value < self.mins[field]:
+                self.mins[field] = value
+        for field, value in other.maxs.items():
+            if field not in self.maxs or value > self.maxs[field]:
+                self.maxs[field] = value
+    
+    def flush(self, r, key: str, merge_script):
+        """
+        把部分结果合并到 Redis（单个 MULTI 事务），已合并的字段从本地状态中移除
+        
+        MULTI/EXEC 不回滚：个别命令执行失败时其余命令照常生效，
+        因此只保留失败命令对应的字段供下次重试，避免重复累加，并抛出 RuntimeError
+        """
+        if self.empty():
+            return
+        pipe = r.pipeline()
+        # 每条命令对应的本地字段 [(所在字典, 字段名), ...]
+        applies = []
+        for field, n in self.counts.items():
+            pipe.hincrby(key, field, n)
+            applies.append([(self.counts, field)])
+        for field, value in self.sums.items():
+            pipe.hincrbyfloat(key, field, value)
+            applies.append([(self.sums, field)])
+        extremes = {**self.mins, **self.maxs}
+        if extremes:
+            args = [item for pair in extremes.items() for item in pair]
+            merge_script(keys=[key], args=args, client=pipe)
+            applies.append([(self.mins, f) for f in self.mins] + [(self.maxs, f) for f in self.maxs])
+        results = pipe.execute(raise_on_error=False)
+        failures = []
+        for fields, result in zip(applies, results):
+            if isinstance(result, Exception):
+                failures.append(f"{fields[0][1]}: {result}")
+                continue
+            for store, field in fields:
+                del store[field]
+        if failures:
+            raise RuntimeError(f"{len(failures)} reduce commands failed ({'; '.join(failures)})")
+
+
+def reduce_task(task_data: str, agg: Aggregator, header: str = None):
+    """
+    聚合模式下处理单个任务：把结果记入 agg，而不是返回字符串
+    
+    Args:
+        task_data: 从队列取出的任务数据（字符串或 JSON）
+        agg: 本地聚合器
+        header: 共享文件区间的表头行（--skip-header），其他情况为 None
+    """
+    # TODO: 在这里实现具体的聚合逻辑
+    # 示例：平方和、个数与最值
+    n = float(task_data)
+    agg.count("n")
+    agg.add("square", n * n)
+    agg.min("n", n)
+    agg.max("n", n)
+
+
+# 可选：聚合模式下下标区间的向量化实现（需要 numpy），x 为 int64 数组 [start, stop)
+# 定义后（替换下面的 None）range 描述符整段调用它，不再逐点调用 reduce_task，
+# 结果须与 reduce_task 一致，例如
+#
+# def reduce_range(x, agg: Aggregator):
+#     if len(x):
+#         y = x.astype(float)
+#         agg.count("n", len(y))
+#         agg.add("square", float(numpy.dot(y, y)))
+#         agg.min("n", float(y.min()))
+#         agg.max("n", float(y.max()))
+reduce_range = None
+
+# 可选：聚合模式下参数网格的向量化实现（需要 numpy），points 与 process_grid 相同，例如
+#
+# def reduce_grid(points: dict, agg: Aggregator):
+#     y = points["sigma"] * numpy.sqrt(points["trial"] + 1)
+#     agg.count("n", len(y))
+#     agg.add("y", float(y.sum()))
+reduce_grid = None
+
+
+def reduce_chunk(chunk: dict, agg: Aggregator) -> int:
+    """
+    聚合模式下处理一个批量任务描述符，返回处理的点数
+    
+    定义了 reduce_range / reduce_grid 且安装了 numpy 时，下标区间 / 参数网格整段调用对应钩子；
+    其他情况逐点调用 reduce_task。
+    整段先聚合到临时聚合器，成功后才并入 agg；中途失败时整段不计入结果
+    """
+    scratch = Aggregator()
+    hook = vectorised(chunk, reduce_range, reduce_grid)
+    if hook is not None:
+        func, arg = hook
+        func(arg, scratch)
+        n = max(0, chunk["stop"] - chunk["start"])
+    else:
+        n = 0
+        for item in iter_chunk(chunk):
+            reduce_task(item, scratch)
+            n += 1
+    agg.merge(scratch)
+    return n
+
+
+def reduce_item(task_data: str, agg: Aggregator, header: str = None):
+    """聚合模式下处理单个任务或共享文件的一行；失败时不留下部分结果"""
+    scratch = Aggregator()
+    reduce_task(task_data, scratch, header)
+    agg.merge(scratch)
+
+
+def flush_aggregator(agg, r_out, merge_script):
+    """合并部分结果到 REDUCE_KEY；失败时保留未合并的字段，下次重试"""
+    try:
+        agg.flush(r_out, REDUCE_KEY, merge_script)
+    except Exception as e:
+        print(f"[{NODE_ID}:{INSTANCE_ID}] Reduce flush failed: {e}")
+
+
+class ProgressCounters:
+    """
+    本实例在某个输入队列上尚未发布的进度增量
+    
+    publish() 用 HINCRBY 累加到 <queue>:progress（字段 items|tasks|errors:<node>:<instance>），
+    并在 <queue>:heartbeat 记录最近一次发布时间
+    """
+    
+    def __init__(self, queue: str):
+        self.progress_key = f"{queue}:progress"
+        self.heartbeat_key = f"{queue}:heartbeat"
+        self.worker = f"{NODE_ID}:{INSTANCE_ID}"
+        self.reset()
+    
+    def reset(self):
+        self.items = 0
+        self.tasks = 0
+        self.errors = 0
+    
+    def publish(self, r):
+        pipe = r.pipeline()
+        for name in ("items", "tasks", "errors"):
+            n = getattr(self, name)
+            if n:
+                pipe.hincrby(self.progress_key, f"{name}:{self.worker}", n)
+        pipe.hset(self.heartbeat_key, self.worker, f"{time.time():.3f}")
+        pipe.execute()
+        self.reset()
+
+
+def publish_progress(counters: dict, r_in):
+    """发布各队列的进度增量；失败时保留计数，下次重试"""
+    for c in counters.values():
+        try:
+            c.publish(r_in)
+        except Exception as e:
+            print(f"[{NODE_ID}:{INSTANCE_ID}] Progress publish failed: {e}")
+
+
+class Heartbeat:
+    """
+    后台线程按 PROGRESS_SECONDS 刷新各队列的 <queue>:heartbeat，与批次边界无关
+    
+    单个任务或区间耗时较长时，实例不会因为迟迟没有发布进度而被 monitor.py 标记为失联
+    """
+    
+    def __init__(self, r, queues: list):
+        self.r = r
+        self.keys = [f"{queue}:heartbeat" for queue in queues]
+        self.worker = f"{NODE_ID}:{INSTANCE_ID}"
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def _run(self):
+        while not self.stopping.wait(PROGRESS_SECONDS):
+            try:
+                pipe = self.r.pipeline()
+                for key in self.keys:
+                    pipe.hset(key, self.worker, f"{time.time():.3f}")
+                pipe.execute()
+            except Exception as e:
+                print(f"[{NODE_ID}:{INSTANCE_ID}] Heartbeat failed: {e}")
+    
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+
+def get_rss_mb() -> float:
+    """当前进程常驻内存（MB）；非 Linux 时退化为峰值 RSS"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def recycle_reason(tasks: int, check_rss: bool = True):
+    """
+    检查是否需要回收工作进程，返回原因或 None
+    
+    Args:
+        tasks: 本工作进程处理的任务数（批量描述符算一个任务，含失败的任务）
+        check_rss: 是否检查 RSS
+    """
+    if MAX_TASKS_PER_WORKER and tasks >= MAX_TASKS_PER_WORKER:
+        return f"reached {tasks:,} tasks"
+    if MAX_RSS_MB and check_rss:
+        rss = get_rss_mb()
+        if rss >= MAX_RSS_MB:
+            return f"RSS {rss:.0f} MB >= {MAX_RSS_MB:.0f} MB"
+    return None
+
+
+def log_top_allocations():
+    """打印 tracemalloc 采样到的前 N 个分配位置（只覆盖 Python 层分配）"""
+    if not tracemalloc.is_tracing():
+        return
+    stats = tracemalloc.take_snapshot().statistics("lineno")
+    for stat in stats[:TRACEMALLOC_TOP]:
+        print(f"[{NODE_ID}:{INSTANCE_ID}]   {stat}")
+
+
+def recycle_worker():
+    """
+    原地重启工作进程（os.execv），释放原生库累积的内存
+    
+    容器不退出，GridNode 不感知；调用前必须已写回当前任务的结果
+    """
+    sys.stdout.flush()
+    os.environ["WORKER_GENERATION"] = str(WORKER_GENERATION + 1)
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
 def main():
     print(f"[{NODE_ID}:{INSTANCE_ID}] Task '{TASK_NAME}' consumer starting...")
-    print(f"  Input:  {INPUT_QUEUE}")
-    print(f"  Output: {OUTPUT_QUEUE}")
+    if POOL_MODE:
+        print(f"  Pool:   {QUEUE_POLICY} over {len(QUEUES)} queues")
+        for name, weight in QUEUES:
+            func, output_queue = resolve_handler(name)
+            print(f"    {name} (weight {weight:g}) -> {func.__name__} -> {output_queue}")
+    else:
+        print(f"  Input:  {INPUT_QUEUE}")
+        print(f"  Output: {OUTPUT_QUEUE}")
+    if REDUCE_KEY:
+        print(f"  Reduce: {REDUCE_KEY} (flush every {REDUCE_FLUSH_SECONDS:g}s)")
+    if BATCH_SIZE > 1 or PREFETCH_BATCHES:
+        print(f"  Fetch:  batch {BATCH_SIZE}, prefetch {PREFETCH_BATCHES} batches "
+              f"(max {PREFETCH_MAX_ITEMS} tasks)")
+    if MAX_RSS_MB or MAX_TASKS_PER_WORKER:
+        print(f"  Recycle: rss>={MAX_RSS_MB:g}MB or tasks>={MAX_TASKS_PER_WORKER} "
+              f"(generation {WORKER_GENERATION})")
+    hooks = (process_range, process_grid, reduce_range, reduce_grid)
+    if numpy is None and any(h is not None for h in hooks):
+        print(f"[{NODE_ID}:{INSTANCE_ID}] numpy not installed, "
+              f"range/grid chunks fall back to per-point processing")
+    if TRACEMALLOC_TOP:
+        tracemalloc.start()
+    if POOL_MODE and REDUCE_KEY:
+        # 多个作业共用一个结果哈希会混在一起
+        print(f"[{NODE_ID}:{INSTANCE_ID}] ✗ REDUCE_KEY is not supported with INPUT_QUEUES, "
+              f"run reduce jobs in a single-queue consumer")
+        sys.exit(1)
     
     # 连接 Redis
     try:
@@ -59,15 +905,63 @@ def main():
     
     processed = 0
     errors = 0
+    # 本工作进程处理的任务数与批次数（内存守护用，重启后清零）
+    worker_tasks = 0
+    worker_batches = 0
+    rss_check = bool(MAX_RSS_MB)
+    next_report = 1000
     start_time = time.time()
     
+    agg = Aggregator() if REDUCE_KEY else None
+    merge_script = r_out.register_script(MERGE_MINMAX_LUA) if REDUCE_KEY else None
+    last_flush = start_time
+    
+    counters = {name: ProgressCounters(name) for name, _ in QUEUES}
+    last_publish = start_time
+    last_task = start_time
+    publish_progress(counters, r_in)
+    
+    # 心跳线程使用独立连接，长任务处理期间照常上报
+    heartbeat = Heartbeat(redis.from_url(INPUT_REDIS_URL), list(counters))
+    heartbeat.start()
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
+    # 预取线程使用独立连接
+    fetcher = None
+    if PREFETCH_BATCHES:
+        fetcher = Prefetcher(redis.from_url(INPUT_REDIS_URL))
+        fetcher.start()
+    
+    # 当前批次及下一个待处理任务的位置，中断时从 pos 起放回队列
+    batch, pos = [], 0
+    unfinished = []
     try:
         while True:
             try:
-                # 阻塞等待任务（超时5秒，便于优雅退出）
-                result = r_in.brpop(INPUT_QUEUE, timeout=5)
+                batch, pos = [], 0
+                # 等待下一批任务（超时5秒，便于优雅退出）
+                with signals_deferred():
+                    if fetcher is not None:
+                        batch = fetcher.get(timeout=5)
+                    else:
+                        batch = fetch_batch(r_in, BATCH_SIZE, timeout=5)
                 
-                if result is None:
+                if not batch:
+                    # 空闲超时：发布积压计数、合并部分结果并刷新心跳，避免空闲实例被标记失联
+                    publish_progress(counters, r_in)
+                    last_publish = time.time()
+                    if agg is not None and not agg.empty():
+                        flush_aggregator(agg, r_out, merge_script)
+                        last_flush = time.time()
+                    
+                    # 常驻模式：空闲时继续等待新作业
+                    if POOL_MODE:
+                        if POOL_IDLE_EXIT and time.time() - last_task >= POOL_IDLE_EXIT:
+                            print(f"[{NODE_ID}:{INSTANCE_ID}] Idle for {POOL_IDLE_EXIT:g}s, exiting. "
+                                  f"Processed: {processed} (errors: {errors})")
+                            break
+                        continue
                     # 超时，检查队列是否为空
                     if r_in.llen(INPUT_QUEUE) == 0:
                         elapsed = time.time() - start_time
@@ -76,36 +970,141 @@ def main():
                         break
                     continue
                 
-                # 解析任务
-                _, task_data = result
-                task_str = task_data.decode() if isinstance(task_data, bytes) else task_data
+                last_task = time.time()
+                for pos, (queue, task_str) in enumerate(batch):
+                    func, output_queue = resolve_handler(queue)
+                    counter = counters[queue]
+                    
+                    # 处理任务（批量描述符在本地展开，结果一次写回）
+                    done_before = processed
+                    try:
+                        chunk = parse_chunk(task_str)
+                        if chunk is not None and chunk["type"] == "file":
+                            # 共享文件逐行处理，坏行只记录该行；聚合结果整个区间完成后再合并
+                            chunk_agg = None
+                            if agg is not None and func is process_task:
+                                chunk_agg = Aggregator()
+                                handle = lambda line, *header: reduce_item(line, chunk_agg, *header)
+                            else:
+                                handle = func
+                            emit = lambda outputs: r_out.lpush(output_queue, *outputs)
+                            ok, failed = run_file_chunk(chunk, handle, emit)
+                            if chunk_agg is not None:
+                                agg.merge(chunk_agg)
+                            processed += ok
+                            errors += failed
+                            counter.errors += failed
+                            if agg is not None and failed:
+                                agg.count("errors", failed)
+                        elif agg is not None and func is process_task:
+                            if chunk is None:
+                                reduce_item(task_str, agg)
+                                processed += 1
+                            else:
+                                processed += reduce_chunk(chunk, agg)
+                        else:
+                            outputs = run_handler(func, task_str)
+                            if outputs:
+                                r_out.lpush(output_queue, *outputs)
+                            processed += len(outputs)
+                    except Exception as e:
+                        # 处理失败，记录错误但不中断
+                        error_msg = f"ERROR:{task_str}:{str(e)}"
+                        r_out.lpush(output_queue, error_msg)
+                        errors += 1
+                        counter.errors += 1
+                        if agg is not None:
+                            agg.count("errors")
+                    counter.tasks += 1
+                    counter.items += processed - done_before
+                    worker_tasks += 1
+                pos = len(batch)
+                worker_batches += 1
+                
+                # 定期发布进度计数
+                if time.time() - last_publish >= PROGRESS_SECONDS:
+                    publish_progress(counters, r_in)
+                    last_publish = time.time()
                 
-                # 处理任务
-                try:
-                    output = process_task(task_str)
-                    r_out.lpush(OUTPUT_QUEUE, output)
-                    processed += 1
-                except Exception as e:
-                    # 处理失败，记录错误但不中断
-                    error_msg = f"ERROR:{task_str}:{str(e)}"
-                    r_out.lpush(OUTPUT_QUEUE, error_msg)
-                    errors += 1
+                # 定期合并部分聚合结果
+                if agg is not None and time.time() - last_flush >= REDUCE_FLUSH_SECONDS:
+                    flush_aggregator(agg, r_out, merge_script)
+                    last_flush = time.time()
                 
                 # 每处理 1000 条打印一次进度
-                if processed % 1000 == 0:
+                if processed >= next_report:
+                    next_report = (processed // 1000 + 1) * 1000
                     elapsed = time.time() - start_time
                     speed = processed / elapsed
                     print(f"[{NODE_ID}:{INSTANCE_ID}] Progress: {processed:,} tasks "
-                          f"@ {speed:.0f}/s (errors: {errors})")
+                          f"@ {speed:.0f}/s (errors: {errors}, rss: {get_rss_mb():.0f} MB)")
+                    log_top_allocations()
+                
+                # 内存守护：当前批次已写回，超限则合并部分结果后原地重启
+                # 第一批只记录预热后的 RSS（导入 numpy/Pillow 等），已超限时不再按 RSS 回收，避免反复重启
+                if rss_check and worker_batches == 1:
+                    warm_rss = get_rss_mb()
+                    if warm_rss >= MAX_RSS_MB:
+                        print(f"[{NODE_ID}:{INSTANCE_ID}] RSS {warm_rss:.0f} MB after first batch "
+                              f"already >= MAX_RSS_MB ({MAX_RSS_MB:g}), RSS limit disabled for "
+                              f"this worker; raise MAX_RSS_MB")
+                        rss_check = False
+                reason = recycle_reason(worker_tasks, rss_check and worker_batches > 1)
+                if reason and agg is not None:
+                    flush_aggregator(agg, r_out, merge_script)
+                    if not agg.empty():
+                        # 合并失败，保留部分结果，下一轮再试
+                        reason = None
+                if reason:
+                    publish_progress(counters, r_in)
+                    print(f"[{NODE_ID}:{INSTANCE_ID}] Recycling worker: {reason}")
+                    log_top_allocations()
+                    if fetcher is not None:
+                        try:
+                            fetcher.stop()
+                        except Exception as e:
+                            # 预取的任务没能放回，重启预取线程继续处理，下一批再尝试回收
+                            print(f"[{NODE_ID}:{INSTANCE_ID}] Failed to return prefetched tasks, "
+                                  f"postponing recycle: {e}")
+                            fetcher.start()
+                            reason = None
+                    if reason:
+                        try:
+                            recycle_worker()
+                        finally:
+                            # execv 成功时不会返回；失败时重启预取线程，避免之后一直取到空批次
+                            if fetcher is not None:
+                                fetcher.start()
                     
             except Exception as e:
                 print(f"[{NODE_ID}:{INSTANCE_ID}] Error: {e}")
+                return_unfinished(r_in, batch[pos:])
+                # 已放回（或已报告丢失），避免中断时再放回一次
+                batch, pos = [], 0
                 time.sleep(1)
     
     except KeyboardInterrupt:
+        # 清理期间不再响应 SIGTERM，避免放回任务、合并结果被打断
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
         elapsed = time.time() - start_time
         print(f"\n[{NODE_ID}:{INSTANCE_ID}] Interrupted. "
               f"Processed: {processed} (errors: {errors}) in {elapsed:.1f}s")
+        # 正在处理的任务结果尚未写回，连同批次剩余任务一并放回（至少一次语义）
+        unfinished = batch[pos:]
+    
+    if fetcher is not None:
+        # 当前批次先于预取的批次取出，一次放回，保持原有顺序
+        try:
+            fetcher.stop(unfinished)
+        except Exception as e:
+            print(f"[{NODE_ID}:{INSTANCE_ID}] Failed to return "
+                  f"{len(unfinished) + fetcher.held} tasks to queue: {e}")
+    else:
+        return_unfinished(r_in, unfinished)
+    heartbeat.stop()
+    if agg is not None:
+        flush_aggregator(agg, r_out, merge_script)
+    publish_progress(counters, r_in)
     
     print(f"[{NODE_ID}:{INSTANCE_ID}] Done. Total processed: {processed}, errors: {errors}")
 